@@ -0,0 +1,688 @@
+"""
+Asynchronous SNMPv2c backend for snmplib
+
+Instead of one blocking easysnmp session per host, a single SNMPClient multiplexes the requests for many hosts over
+a small pool of UDP sockets. PDUs are encoded and decoded here, responses are matched to their requests by
+request-id, and timeouts and retries are handled by the event loop.
+"""
+import asyncio
+import collections
+import random
+import socket
+
+from snmplib import PrinterInfo, PrinterProperties, Supply, Tray
+
+# BER / SNMP tags
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_NULL = 0x05
+TAG_OBJECT_ID = 0x06
+TAG_SEQUENCE = 0x30
+TAG_IPADDRESS = 0x40
+TAG_COUNTER32 = 0x41
+TAG_GAUGE32 = 0x42
+TAG_TIMETICKS = 0x43
+TAG_OPAQUE = 0x44
+TAG_COUNTER64 = 0x46
+TAG_NO_SUCH_OBJECT = 0x80
+TAG_NO_SUCH_INSTANCE = 0x81
+TAG_END_OF_MIB_VIEW = 0x82
+
+PDU_GET = 0xA0
+PDU_GETNEXT = 0xA1
+PDU_RESPONSE = 0xA2
+PDU_GETBULK = 0xA5
+
+SNMP_VERSION_2C = 1
+ERROR_TOO_BIG = 1
+
+# Names of the value types as reported by easysnmp, so that both backends return identical SNMPVariables
+SNMP_TYPES = {
+    TAG_INTEGER: "INTEGER",
+    TAG_OCTET_STRING: "OCTETSTR",
+    TAG_NULL: "NULL",
+    TAG_OBJECT_ID: "OBJECTID",
+    TAG_IPADDRESS: "IPADDR",
+    TAG_COUNTER32: "COUNTER",
+    TAG_GAUGE32: "GAUGE",
+    TAG_TIMETICKS: "TICKS",
+    TAG_OPAQUE: "OPAQUE",
+    TAG_COUNTER64: "COUNTER64",
+    TAG_NO_SUCH_OBJECT: "NOSUCHOBJECT",
+    TAG_NO_SUCH_INSTANCE: "NOSUCHINSTANCE",
+    TAG_END_OF_MIB_VIEW: "ENDOFMIBVIEW"
+}
+
+
+class SNMPError(Exception):
+    """
+    Raised if an SNMP request fails or the agent reports an error
+    """
+    pass
+
+
+class SNMPTimeoutError(SNMPError):
+    """
+    Raised if an agent does not answer within the configured timeout and retries
+    """
+    pass
+
+
+class SNMPVariable(object):
+    """
+    Result of an SNMP request, equivalent to easysnmp's SNMPVariable
+    """
+    def __init__(self, oid, value, snmp_type):
+        self.oid = oid
+        self.oid_index = oid.rsplit(".", 1)[-1]
+        self.value = value
+        self.snmp_type = snmp_type
+
+    def __repr__(self):
+        return "<SNMPVariable value='%s' (oid='%s', snmp_type='%s')>" % (self.value, self.oid, self.snmp_type)
+
+
+def normalize_oid(oid):
+    """
+    Converts an OID in one of the forms accepted by easysnmp to a dotted string
+    :param oid: either "1.3.6.1.2.1.1.5.0" or a tuple ("1.3.6.1.2.1.1.5", 0)
+    :return: dotted OID without a leading dot
+    :rtype: str
+    """
+    if isinstance(oid, tuple):
+        oid = "%s.%s" % oid
+    return oid.strip(".")
+
+
+def _parse_oid(oid):
+    return tuple(int(x) for x in normalize_oid(oid).split("."))
+
+
+def _encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    raw = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(raw)]) + raw
+
+
+def _encode_tlv(tag, payload):
+    return bytes([tag]) + _encode_length(len(payload)) + payload
+
+
+def _encode_integer(value):
+    return _encode_tlv(TAG_INTEGER, value.to_bytes(value.bit_length() // 8 + 1, "big", signed=True))
+
+
+def _oid_payload(oid):
+    parts = [oid[0] * 40 + oid[1]] + list(oid[2:])
+    if max(parts) < 0x80:
+        # every sub-id fits into one byte, true for almost all printer MIB OIDs
+        return bytes(parts)
+    payload = bytearray()
+    for part in parts:
+        chunk = [part & 0x7F]
+        part >>= 7
+        while part:
+            chunk.append(0x80 | (part & 0x7F))
+            part >>= 7
+        payload.extend(reversed(chunk))
+    return bytes(payload)
+
+
+def _encode_oid(oid):
+    return _encode_tlv(TAG_OBJECT_ID, _oid_payload(oid))
+
+
+def encode_request(community, pdu_type, request_id, oids, non_repeaters=0, max_repetitions=0):
+    """
+    Encodes an SNMPv2c GET, GETNEXT or GETBULK message
+    :param community: community string
+    :type community: str
+    :param pdu_type: one of PDU_GET, PDU_GETNEXT, PDU_GETBULK
+    :param request_id: id used to match the response to the request
+    :type request_id: int
+    :param oids: list of OID tuples to request
+    :param non_repeaters: error-status field, used as non-repeaters for GETBULK
+    :param max_repetitions: error-index field, used as max-repetitions for GETBULK
+    :return: encoded message
+    :rtype: bytes
+    """
+    varbinds = b"".join(_encode_tlv(TAG_SEQUENCE, _encode_oid(oid) + _encode_tlv(TAG_NULL, b"")) for oid in oids)
+    pdu = _encode_tlv(pdu_type, _encode_integer(request_id) + _encode_integer(non_repeaters) +
+                      _encode_integer(max_repetitions) + _encode_tlv(TAG_SEQUENCE, varbinds))
+    return _encode_tlv(TAG_SEQUENCE, _encode_integer(SNMP_VERSION_2C) +
+                       _encode_tlv(TAG_OCTET_STRING, community.encode()) + pdu)
+
+
+def _encode_value(tag, value):
+    """
+    Encodes a varbind value
+    :param tag: one of the TAG_* constants
+    :param value: int for INTEGER and the unsigned types, str or bytes for OCTET STRING and Opaque, OID tuple for
+                  OBJECT IDENTIFIER, dotted string for IpAddress, None for NULL and the exceptions
+    :return: encoded value
+    :rtype: bytes
+    """
+    if tag == TAG_INTEGER:
+        return _encode_integer(value)
+    if tag in (TAG_COUNTER32, TAG_GAUGE32, TAG_TIMETICKS, TAG_COUNTER64):
+        return _encode_tlv(tag, value.to_bytes(value.bit_length() // 8 + 1, "big"))
+    if tag in (TAG_OCTET_STRING, TAG_OPAQUE):
+        return _encode_tlv(tag, value.encode() if isinstance(value, str) else value)
+    if tag == TAG_OBJECT_ID:
+        return _encode_oid(value)
+    if tag == TAG_IPADDRESS:
+        return _encode_tlv(tag, bytes(int(x) for x in value.split(".")))
+    return _encode_tlv(tag, b"")
+
+
+def encode_response(community, request_id, varbinds, error_status=0, error_index=0):
+    """
+    Encodes an SNMPv2c response message, as an agent would send it
+    :param community: community string
+    :type community: str
+    :param request_id: id of the request that is answered
+    :type request_id: int
+    :param varbinds: list of (OID tuple, tag, value) triples, see _encode_value
+    :return: encoded message
+    :rtype: bytes
+    """
+    encoded = b"".join(_encode_tlv(TAG_SEQUENCE, _encode_oid(oid) + _encode_value(tag, value))
+                       for oid, tag, value in varbinds)
+    pdu = _encode_tlv(PDU_RESPONSE, _encode_integer(request_id) + _encode_integer(error_status) +
+                      _encode_integer(error_index) + _encode_tlv(TAG_SEQUENCE, encoded))
+    return _encode_tlv(TAG_SEQUENCE, _encode_integer(SNMP_VERSION_2C) +
+                       _encode_tlv(TAG_OCTET_STRING, community.encode()) + pdu)
+
+
+def _decode_tlv(data, pos):
+    """
+    Decodes the header of a BER element
+    :return: tag, start of the payload, end of the payload
+    """
+    if pos + 2 > len(data):
+        raise SNMPError("Truncated SNMP message")
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        num = length & 0x7F
+        length = int.from_bytes(data[pos:pos + num], "big")
+        pos += num
+    end = pos + length
+    if end > len(data):
+        raise SNMPError("Truncated SNMP message")
+    return tag, pos, end
+
+
+def _expect(data, pos, tag):
+    actual, start, end = _decode_tlv(data, pos)
+    if actual != tag:
+        raise SNMPError("Unexpected tag 0x%02x, expected 0x%02x" % (actual, tag))
+    return start, end
+
+
+def _decode_sub_ids(payload):
+    if max(payload, default=0) < 0x80:
+        # every sub-id fits into one byte, true for almost all printer MIB OIDs
+        return tuple(payload)
+    parts = []
+    value = 0
+    for byte in payload:
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            parts.append(value)
+            value = 0
+    return tuple(parts)
+
+
+def _decode_oid(payload):
+    parts = _decode_sub_ids(payload)
+    first = min(parts[0] // 40, 2)
+    return (first, parts[0] - first * 40) + tuple(parts[1:])
+
+
+def _decode_value(tag, payload):
+    """
+    Converts a varbind value to the string representation easysnmp returns
+    :return: value, easysnmp type name
+    :rtype: tuple
+    """
+    if tag == TAG_INTEGER:
+        value = str(int.from_bytes(payload, "big", signed=True))
+    elif tag in (TAG_COUNTER32, TAG_GAUGE32, TAG_TIMETICKS, TAG_COUNTER64):
+        value = str(int.from_bytes(payload, "big"))
+    elif tag == TAG_OCTET_STRING:
+        value = payload.decode("utf-8", "surrogateescape")
+    elif tag == TAG_OBJECT_ID:
+        value = "." + ".".join(map(str, _decode_oid(payload)))
+    elif tag == TAG_IPADDRESS:
+        value = ".".join(str(x) for x in payload)
+    elif tag == TAG_OPAQUE:
+        value = payload.decode("latin-1")
+    elif tag == TAG_NULL:
+        value = ""
+    else:
+        value = SNMP_TYPES.get(tag, "UNKNOWN")
+    return value, SNMP_TYPES.get(tag, "UNKNOWN")
+
+
+def decode_request(data):
+    """
+    Decodes an SNMPv2c request message, the counterpart of encode_request
+    :param data: raw datagram
+    :type data: bytes
+    :return: community, PDU type, request id, non-repeaters (error status), max-repetitions (error index) and the
+             list of requested OID tuples
+    :rtype: tuple
+    """
+    start, end = _expect(data, 0, TAG_SEQUENCE)
+    start, pos = _expect(data, start, TAG_INTEGER)
+    start, pos = _expect(data, pos, TAG_OCTET_STRING)
+    community = bytes(data[start:pos]).decode("utf-8", "surrogateescape")
+    pdu_type = data[pos]
+    pos, end = _expect(data, pos, pdu_type)
+    fields = []
+    for _ in range(3):
+        start, pos = _expect(data, pos, TAG_INTEGER)
+        fields.append(int.from_bytes(data[start:pos], "big", signed=True))
+    pos, end = _expect(data, pos, TAG_SEQUENCE)
+    oids = []
+    while pos < end:
+        start, pos = _expect(data, pos, TAG_SEQUENCE)
+        oid_start, oid_end = _expect(data, start, TAG_OBJECT_ID)
+        oids.append(_decode_oid(data[oid_start:oid_end]))
+    return community, pdu_type, fields[0], fields[1], fields[2], oids
+
+
+def _decode_header(data):
+    """
+    Decodes a response message up to its varbind list
+    :return: request id, error status, error index, start and end of the varbind list
+    :rtype: tuple
+    """
+    start, end = _expect(data, 0, TAG_SEQUENCE)
+    start, pos = _expect(data, start, TAG_INTEGER)
+    start, pos = _expect(data, pos, TAG_OCTET_STRING)
+    pos, end = _expect(data, pos, PDU_RESPONSE)
+    fields = []
+    for _ in range(3):
+        start, pos = _expect(data, pos, TAG_INTEGER)
+        fields.append(int.from_bytes(data[start:pos], "big", signed=True))
+    pos, end = _expect(data, pos, TAG_SEQUENCE)
+    return fields[0], fields[1], fields[2], pos, end
+
+
+def _iter_varbinds(data, pos, end):
+    """
+    Splits a varbind list without decoding OIDs and values
+    :return: generator of (start of the OID payload, end of the OID payload, value tag, start and end of the value
+             payload) tuples
+    """
+    while pos < end:
+        start, pos = _expect(data, pos, TAG_SEQUENCE)
+        oid_start, oid_end = _expect(data, start, TAG_OBJECT_ID)
+        tag, val_start, val_end = _decode_tlv(data, oid_end)
+        yield oid_start, oid_end, tag, val_start, val_end
+
+
+def _decode_varbind(data, oid_start, oid_end, tag, val_start, val_end):
+    """
+    :return: OID tuple and SNMPVariable of a varbind located by _iter_varbinds
+    :rtype: tuple
+    """
+    oid = _decode_oid(data[oid_start:oid_end])
+    value, snmp_type = _decode_value(tag, bytes(data[val_start:val_end]))
+    return oid, SNMPVariable(".".join(map(str, oid)), value, snmp_type)
+
+
+def decode_response(data):
+    """
+    Decodes an SNMPv2c response message
+    :param data: raw datagram
+    :type data: bytes
+    :return: request id, error status, error index and a list of (OID tuple, SNMPVariable) pairs
+    :rtype: tuple
+    """
+    request_id, status, index, pos, end = _decode_header(data)
+    varbinds = [_decode_varbind(data, *varbind) for varbind in _iter_varbinds(data, pos, end)]
+    return request_id, status, index, varbinds
+
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    """
+    Hands every datagram received on one of the client's sockets back to the client
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._dispatch(data, addr)
+
+    def error_received(self, exc):
+        # ICMP errors cannot be attributed to a request, the request will run into its timeout
+        pass
+
+
+class SNMPClient(object):
+    """
+    Multiplexes SNMPv2c requests for any number of hosts over a small pool of UDP sockets
+    """
+    def __init__(self, community="public", timeout=1.0, retries=3, sockets=4, max_repetitions=25, port=161,
+                 receive_buffer=2 ** 20, limiter=None, dns_ttl=300, dns_cache_size=4096):
+        """
+        :param community: community string used for all hosts
+        :param timeout: seconds to wait for a response before a request is sent again
+        :param retries: number of times a request is repeated before giving up
+        :param sockets: number of UDP sockets shared by all requests
+        :param max_repetitions: number of rows requested per GETBULK
+        :param port: SNMP port of the agents
+        :param receive_buffer: requested size of each socket's receive buffer in bytes. Many responses arrive on few
+                               sockets, so the default buffer would overflow and drop responses under load
+        :param limiter: optional ratelimit.RateLimiter every request (including retries) has to pass before it is sent
+        :param dns_ttl: seconds a resolved host address is cached
+        :param dns_cache_size: number of host names whose addresses are cached, the least recently used are dropped
+        """
+        self.community = community
+        self.timeout = timeout
+        self.retries = retries
+        self.num_sockets = sockets
+        self.max_repetitions = max_repetitions
+        self.port = port
+        self.receive_buffer = receive_buffer
+        self.limiter = limiter
+        self._transports = []
+        self._pending = {}
+        self.dns_ttl = dns_ttl
+        self.dns_cache_size = dns_cache_size
+        # host -> (expiry time, address), least recently used first
+        self._addresses = collections.OrderedDict()
+        # host -> future of a lookup in progress
+        self._lookups = {}
+        self._next_id = random.randrange(1, 2 ** 31 - 1)
+
+    async def open(self):
+        """
+        Creates the UDP sockets
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        for _ in range(self.num_sockets):
+            transport, _ = await loop.create_datagram_endpoint(lambda: _ClientProtocol(self),
+                                                               local_addr=("0.0.0.0", 0), family=socket.AF_INET)
+            if self.receive_buffer:
+                transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                                              self.receive_buffer)
+            self._transports.append(transport)
+
+    def close(self):
+        """
+        Closes all sockets and fails the requests still in flight. The limiter is not closed, it belongs to the caller
+        :return: None
+        """
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+        for future, _ in self._pending.values():
+            if not future.done():
+                future.set_exception(SNMPError("Client closed"))
+        self._pending.clear()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    async def get(self, host, oids):
+        """
+        Requests one or more OIDs with a single GET
+        :param host: host name or address of the agent
+        :param oids: list of OIDs, either strings or (oid, index) tuples
+        :return: one SNMPVariable per requested OID
+        :rtype: list
+        """
+        status, data, pos, end = await self._request(host, PDU_GET, [_parse_oid(oid) for oid in oids])
+        if status == ERROR_TOO_BIG:
+            raise SNMPError("Agent %s returned tooBig for a GET of %d OIDs" % (host, len(oids)))
+        return [_decode_varbind(data, *varbind)[1] for varbind in _iter_varbinds(data, pos, end)]
+
+    async def walk(self, host, oid):
+        """
+        Walks the subtree below the given OID using GETBULK requests
+        :param host: host name or address of the agent
+        :param oid: root of the subtree
+        :return: SNMPVariables of the subtree in lexicographic order
+        :rtype: list
+        """
+        return (await self.walk_table(host, [oid]))[normalize_oid(oid)]
+
+    async def walk_table(self, host, columns):
+        """
+        Walks several subtrees, usually the columns of one table, together: every GETBULK asks for the next rows of
+        all columns that are not complete yet. Varbinds past the end of their column are skipped without being
+        decoded
+        :param host: host name or address of the agent
+        :param columns: list of column OIDs
+        :return: dict of normalized column OID -> SNMPVariables of the column in lexicographic order
+        :rtype: dict
+        """
+        roots = [_parse_oid(column) for column in columns]
+        names = [normalize_oid(column) for column in columns]
+        # a child's encoded OID starts with the encoded OID of its root, only the rest has to be decoded
+        prefixes = [_oid_payload(root) for root in roots]
+        results = [[] for _ in roots]
+        current = list(roots)
+        active = list(range(len(roots)))
+        repetitions = self.max_repetitions
+        while active:
+            status, data, pos, end = await self._request(host, PDU_GETBULK, [current[col] for col in active], 0,
+                                                         repetitions)
+            if status == ERROR_TOO_BIG:
+                if repetitions == 1:
+                    # not even a single row fits, returning what we have would silently truncate the subtrees
+                    raise SNMPError("Agent %s returned tooBig for a single row while walking %s" % (
+                        host, ", ".join(normalize_oid(columns[col]) for col in active)))
+                repetitions //= 2
+                continue
+            done = set()
+            received = False
+            # the varbinds are ordered by row, with one varbind per requested column in each row
+            for idx, varbind in enumerate(_iter_varbinds(data, pos, end)):
+                received = True
+                col = active[idx % len(active)]
+                if col in done:
+                    continue
+                oid_start, oid_end, tag, val_start, val_end = varbind
+                prefix = prefixes[col]
+                if tag == TAG_END_OF_MIB_VIEW or oid_end - oid_start <= len(prefix) or \
+                        not data.startswith(prefix, oid_start, oid_end):
+                    done.add(col)
+                    if len(done) == len(active):
+                        break
+                    continue
+                sub_ids = _decode_sub_ids(data[oid_start + len(prefix):oid_end])
+                vb_oid = roots[col] + sub_ids
+                if vb_oid <= current[col]:
+                    raise SNMPError("OID not increasing while walking %s on %s" % (names[col], host))
+                value, snmp_type = _decode_value(tag, data[val_start:val_end])
+                results[col].append(SNMPVariable(names[col] + "." + ".".join(map(str, sub_ids)), value, snmp_type))
+                current[col] = vb_oid
+            if not received:
+                break
+            active = [col for col in active if col not in done]
+        return dict(zip(names, results))
+
+    async def resolve(self, host):
+        """
+        Resolves a host name, concurrent requests to the same host share one lookup
+        IPv4 addresses are used as they are. Addresses of host names are cached for `dns_ttl` seconds, for at most
+        `dns_cache_size` hosts. Failed lookups are not cached
+        :return: socket address of the agent
+        :rtype: tuple
+        """
+        try:
+            socket.inet_pton(socket.AF_INET, host)
+            return host, self.port
+        except OSError:
+            pass
+        entry = self._addresses.get(host)
+        if entry is not None and entry[0] > asyncio.get_running_loop().time():
+            self._addresses.move_to_end(host)
+            return entry[1]
+        future = self._lookups.get(host)
+        if future is None:
+            future = asyncio.ensure_future(self._lookup(host))
+            future.add_done_callback(lambda f: self._store_address(host, f))
+            self._lookups[host] = future
+        return await asyncio.shield(future)
+
+    async def _lookup(self, host):
+        loop = asyncio.get_running_loop()
+        try:
+            info = await loop.getaddrinfo(host, self.port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        except (socket.gaierror, UnicodeError) as e:
+            raise SNMPError("Unable to resolve %s: %s" % (host, e))
+        return info[0][4]
+
+    def _store_address(self, host, future):
+        del self._lookups[host]
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._addresses[host] = (asyncio.get_running_loop().time() + self.dns_ttl, future.result())
+        self._addresses.move_to_end(host)
+        if len(self._addresses) > self.dns_cache_size:
+            self._addresses.popitem(last=False)
+
+    def _new_request_id(self):
+        while True:
+            self._next_id = self._next_id % (2 ** 31 - 1) + 1
+            if self._next_id not in self._pending:
+                return self._next_id
+
+    async def _request(self, host, pdu_type, oids, non_repeaters=0, max_repetitions=0):
+        """
+        Sends a request and waits for the matching response, repeating it on timeout
+        :return: error status, the raw response and the start and end of its varbind list
+        :rtype: tuple
+        """
+        if not self._transports:
+            raise SNMPError("Client is not open")
+        address = await self.resolve(host)
+        request_id = self._new_request_id()
+        packet = encode_request(self.community, pdu_type, request_id, oids, non_repeaters, max_repetitions)
+        transport = self._transports[request_id % len(self._transports)]
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, address[0])
+        try:
+            for _ in range(self.retries + 1):
+                if self.limiter:
+                    await self.limiter.acquire(host, address[0])
+                transport.sendto(packet, address)
+                try:
+                    status, index, data, pos, end = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+                except asyncio.TimeoutError:
+                    continue
+                if status and status != ERROR_TOO_BIG:
+                    raise SNMPError("Agent %s returned error status %d (index %d)" % (host, status, index))
+                return status, data, pos, end
+            raise SNMPTimeoutError("timed out while connecting to remote host %s" % host)
+        finally:
+            self._pending.pop(request_id, None)
+
+    def _dispatch(self, data, addr):
+        try:
+            request_id, status, index, pos, end = _decode_header(data)
+        except (SNMPError, IndexError, ValueError):
+            return
+        pending = self._pending.get(request_id)
+        if pending is None:
+            return
+        future, expected_address = pending
+        if addr[0] != expected_address or future.done():
+            return
+        # the varbinds are decoded by the caller, which knows which of them it needs
+        future.set_result((status, index, data, pos, end))
+
+
+class SNMPSnapshot(object):
+    """
+    Read-only session serving prefetched values
+    Provides the get() and walk() methods of an easysnmp Session, so the parsing code in snmplib can be reused as is
+    """
+    def __init__(self, values, subtrees):
+        self._values = values
+        self._subtrees = subtrees
+
+    def get(self, oid):
+        oid = normalize_oid(oid)
+        if oid not in self._values:
+            return SNMPVariable(oid, "NOSUCHOBJECT", "NOSUCHOBJECT")
+        return self._values[oid]
+
+    def walk(self, oid):
+        return self._subtrees.get(normalize_oid(oid), [])
+
+
+async def fetch_printer(client, host):
+    """
+    Fetches everything PrinterProperties reads from a printer
+    The scalar values are requested with a single GET, the columns of each table are walked together, and all
+    requests of a host run concurrently
+    :param client: open SNMPClient
+    :param host: host name of the printer
+    :return: printer properties backed by the fetched values
+    :rtype: PrinterProperties
+    """
+    # columns of the same table share their parent OID
+    tables = collections.OrderedDict()
+    for oid in list(PrinterInfo.WALK_OIDS) + list(Supply.STRUCTURE) + list(Tray.STRUCTURE):
+        tables.setdefault(oid.rsplit(".", 1)[0], []).append(oid)
+    tasks = [asyncio.ensure_future(client.get(host, PrinterInfo.GET_OIDS))]
+    tasks += [asyncio.ensure_future(client.walk_table(host, columns)) for columns in tables.values()]
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        # if one request failed, the host is unreachable: stop the others instead of letting them time out as well
+        for task in tasks:
+            task.cancel()
+    values = dict(zip(PrinterInfo.GET_OIDS, results[0]))
+    subtrees = dict()
+    for result in results[1:]:
+        subtrees.update(result)
+    return PrinterProperties(host, session=SNMPSnapshot(values, subtrees))
+
+
+async def fetch_printers(client, hosts, concurrency=256):
+    """
+    Fetches the properties of many printers concurrently and yields them as soon as they are complete
+    Hosts are taken from the iterable only when a slot is free, so at most `concurrency` fetches are in memory
+    :param client: open SNMPClient
+    :param hosts: host names of the printers, any iterable
+    :param concurrency: maximum number of hosts polled at the same time
+    :return: async generator of (host, PrinterProperties or None, exception or None) tuples
+    """
+    async def fetch(host):
+        try:
+            return host, await fetch_printer(client, host), None
+        except Exception as e:
+            # the error of one host (SNMP, DNS, ...) must not end the generator for all others
+            return host, None, e
+
+    hosts = iter(hosts)
+    pending = set()
+    try:
+        while True:
+            for host in hosts:
+                pending.add(asyncio.ensure_future(fetch(host)))
+                if len(pending) >= concurrency:
+                    break
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,160 @@
+"""
+Streaming pipeline with bounded queues
+
+Items flow from a source iterable through a chain of stages, each stage runs one or more workers and hands its results
+to the next stage through a bounded queue. A full queue blocks the stage in front of it, so the number of items in
+flight, and with it the memory used, does not depend on the number of items in the source.
+"""
+import asyncio
+import collections
+import inspect
+
+# Marks the end of the stream
+_DONE = object()
+
+
+class Stage(object):
+    """
+    A step of the pipeline
+    `func` is called with one item and returns the item passed to the next stage, or None to drop it.
+    It may be a plain function or a coroutine function
+    """
+    def __init__(self, name, func, workers=1, key=None, key_limit=None, backlog=4096):
+        """
+        :param name: name of the stage
+        :param func: function or coroutine function processing one item
+        :param workers: number of items processed at the same time
+        :param key: optional function or coroutine function returning the key of an item (e.g. the site of a host), or
+                    None if the item is not limited
+        :param key_limit: maximum number of items with the same key processed at the same time. Further items of that
+                          key are set aside and the worker moves on to the next item, so that a slow key does not
+                          occupy every worker. They are picked up as soon as an item of their key is done
+        :param backlog: number of items set aside before the workers stop taking new items
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.key = key
+        self.key_limit = key_limit
+        self.backlog = backlog
+        self.processed = 0
+        self.max_depth = 0
+        self._is_async = inspect.iscoroutinefunction(func)
+        self._key_is_async = inspect.iscoroutinefunction(key)
+        self._running = 0
+        # key -> number of items in progress
+        self._active = collections.Counter()
+        # key -> deque of items set aside
+        self._parked = {}
+        self._num_parked = 0
+        self._room = None
+
+    async def _call(self, item):
+        if self._is_async:
+            return await self.func(item)
+        return self.func(item)
+
+    async def _key(self, item):
+        if self.key is None or self.key_limit is None:
+            return None
+        if self._key_is_async:
+            return await self.key(item)
+        return self.key(item)
+
+    async def _next(self, queue_in):
+        """
+        Takes the next item of the input queue whose key is below its limit, setting aside the others
+        :return: item and its key, or _DONE and None at the end of the stream
+        :rtype: tuple
+        """
+        while True:
+            if self._room is not None:
+                await self._room.wait()
+            self.max_depth = max(self.max_depth, queue_in.qsize())
+            item = await queue_in.get()
+            if item is _DONE:
+                return item, None
+            key = await self._key(item)
+            if key is None or self._active[key] < self.key_limit:
+                return item, key
+            self._parked.setdefault(key, collections.deque()).append(item)
+            self._num_parked += 1
+            if self._num_parked >= self.backlog:
+                if self._room is None:
+                    self._room = asyncio.Event()
+                self._room.clear()
+
+    def _unpark(self, key):
+        """
+        :return: the next item set aside for the given key, None if there is none
+        """
+        parked = self._parked.get(key)
+        if not parked:
+            return None
+        item = parked.popleft()
+        if not parked:
+            del self._parked[key]
+        self._num_parked -= 1
+        if self._room is not None and self._num_parked < self.backlog:
+            self._room.set()
+        return item
+
+    async def _work(self, queue_in, queue_out, downstream_workers):
+        item = None
+        while True:
+            if item is None:
+                item, key = await self._next(queue_in)
+                if item is _DONE:
+                    break
+            if key is not None:
+                self._active[key] += 1
+            try:
+                result = await self._call(item)
+            finally:
+                if key is not None:
+                    self._active[key] -= 1
+                    if not self._active[key]:
+                        del self._active[key]
+            self.processed += 1
+            if result is not None and queue_out is not None:
+                await queue_out.put(result)
+            # an item of the same key that was set aside takes the place of the one just done
+            item = None if key is None else self._unpark(key)
+        # the last worker of the stage passes the end of the stream on
+        self._running -= 1
+        if self._running == 0 and queue_out is not None:
+            for _ in range(downstream_workers):
+                await queue_out.put(_DONE)
+
+
+async def run_pipeline(source, stages, queue_size=64):
+    """
+    Feeds the items of the source through the stages
+    :param source: iterable or async iterable of input items, consumed lazily
+    :param stages: list of Stage objects
+    :param queue_size: capacity of each queue between two stages
+    :return: None
+    """
+    queues = [asyncio.Queue(queue_size) for _ in stages]
+
+    async def feed():
+        if hasattr(source, "__aiter__"):
+            async for item in source:
+                await queues[0].put(item)
+        else:
+            for item in source:
+                await queues[0].put(item)
+        for _ in range(stages[0].workers):
+            await queues[0].put(_DONE)
+
+    tasks = [asyncio.ensure_future(feed())]
+    for idx, stage in enumerate(stages):
+        queue_out = queues[idx + 1] if idx + 1 < len(stages) else None
+        downstream = stages[idx + 1].workers if idx + 1 < len(stages) else 0
+        stage._running = stage.workers
+        tasks += [asyncio.ensure_future(stage._work(queues[idx], queue_out, downstream)) for _ in range(stage.workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,8 +1,7 @@
 #!/usr/bin/env python3
-from snmplib import Rule, PrinterProperties
+from snmplib import Rule, PrinterProperties, load_config
 import argparse
 import sys
-import yaml
 
 
 class SNMPWalker(object):
@@ -10,9 +9,9 @@ class SNMPWalker(object):
     Iterates over the given hosts and checks the given rules
     Either returns info about the device or the status of the checked rules
     """
-    def __init__(self, host_list, rules_list):
+    def __init__(self, host_list, rules):
         self.hosts = host_list
-        self.rules = Rule.parse_rules(rules_list)
+        self.rules = rules
 
     def get_info(self, show_info, show_supplies, show_trays):
         """
@@ -28,12 +27,14 @@ class SNMPWalker(object):
         if not show_info and not show_supplies and not show_trays:
             print("No view options given")
             return
+        # imported once here rather than at start-up, a missing easysnmp must not look like a connection error
+        from easysnmp import EasySNMPError
         for host in self.hosts:
             print("-"*30)
             print(host)
             try:
                 props = PrinterProperties(host)
-            except:
+            except EasySNMPError:
                 print("Connection error")
                 continue
             if show_info:
@@ -55,12 +56,13 @@ class SNMPWalker(object):
         :type sev: int
         :return: None
         """
+        from easysnmp import EasySNMPError
         for host in self.hosts:
             print("-"*30)
             print("Host: %s" % host)
             try:
                 props = PrinterProperties(host)
-            except:
+            except EasySNMPError:
                 print("Connection error")
                 continue
             for typ in [props.get_supplies(), props.get_trays()]:
@@ -82,7 +84,7 @@ class SNMPWalker(object):
 def parse_args_and_config():
     """
     Parses command line arguments and the config file
-    :return: command line arguments, host list, rule list
+    :return: command line arguments, host list, list of Rule objects
     """
     parser = argparse.ArgumentParser(description='Check printers via SNMP.')
     parser.add_argument("--host", "-H", action="append", dest="hosts", metavar="HOST")
@@ -102,12 +104,9 @@ def parse_args_and_config():
     hosts = set()
     rules = []
     if args["config"]:
-        with open(args["config"]) as f:
-            config = yaml.load(f)
-            if "hosts" in config:
-                hosts.update(config["hosts"])
-            if "rules" in config:
-                rules = config["rules"]
+        config, rules = load_config(args["config"])
+        if "hosts" in config:
+            hosts.update(config["hosts"])
     if args["hosts"]:
         hosts.clear()
         hosts.update(args["hosts"])
@@ -117,8 +116,8 @@ def parse_args_and_config():
     return args, hosts, rules
 
 if __name__ == "__main__":
-    a, h, raw_rules = parse_args_and_config()
-    walker = SNMPWalker(h, raw_rules)
+    a, h, rule_objects = parse_args_and_config()
+    walker = SNMPWalker(h, rule_objects)
     if not a["applyrules"]:
         walker.get_info(a["info"], a["supplies"], a["trays"])
     else:
@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
-from snmplib import PrinterProperties, Rule
+from snmplib import PrinterProperties, Rule, load_config, read_config
+import os
 import sys
-import yaml
-import couchdb
 import datetime
-from easysnmp.exceptions import EasySNMPConnectionError 
 
 DB_URL = "https://database-url/"
 DB_DATABASE = "printer_stats"
 TIMESTAMP_FORMAT = "%d.%m.%Y %H:%M:%S"
+# Set if an output sink writes to stdout, diagnostics then go to stderr so they do not corrupt the output
+LOG_TO_STDERR = False
 
 
 # Color definitions used in the mapping below
@@ -98,13 +98,41 @@ def get_header_color(max_status, status_severity):
         return COLOR.HEADER_DEFAULT
 
 
-def check_printer(h, rule_list):
-    # Get basic device info and info about supplies and trays
-    props = PrinterProperties(h)
-    info = props.get_info().get_data()
-    supplies = props.get_supplies()
-    trays = props.get_trays()
+def check_printer(h, rule_list, props=None):
+    """
+    Polls a device and checks the rules against its supplies and trays
+    :param h: host name of the device
+    :param rule_list: list of rules to be matched against
+    :param props: already fetched PrinterProperties, polled with easysnmp if not given
+    :return: document with info, supplies and trays of the device
+    :rtype: dict
+    """
+    if props is None:
+        props = PrinterProperties(h)
+    return evaluate_printer(h, rule_list, *parse_printer(props))
+
+
+def parse_printer(props):
+    """
+    Gets basic device info and info about supplies and trays
+    :param props: PrinterProperties of the device
+    :return: info dictionary, list of Supply objects, list of Tray objects
+    :rtype: tuple
+    """
+    return props.get_info().get_data(), props.get_supplies(), props.get_trays()
+
 
+def evaluate_printer(h, rule_list, info, supplies, trays):
+    """
+    Checks the rules against the supplies and trays of a device and builds its output document
+    :param h: host name of the device
+    :param rule_list: list of rules to be matched against
+    :param info: info dictionary as returned by parse_printer
+    :param supplies: list of Supply objects
+    :param trays: list of Tray objects
+    :return: document with info, supplies and trays of the device
+    :rtype: dict
+    """
     # Initialize the output variables
     out_supplies = []
     out_trays = []
@@ -178,35 +206,343 @@ def check_printer(h, rule_list):
     return data
 
 
-def check_printers(database, h, rule_list):
+def check_printers(sink, h, rule_list):
     """
     Iterates over all devices, fetches general info and info about supplies and trays, and writes this info to the
-    database
-    :param database: CouchDB database object
+    output sink
+    :param sink: Sink object the results are written to
     :param h: host name of the device to be checked
     :param rule_list: list of rules to be matched against
     :return: None
     """
+    from easysnmp.exceptions import EasySNMPConnectionError
     # Iterate over all devices
     for dev in h:
-        if dev not in database:
-            dataset = {
-                "_id": dev,
-                "data": {}
-            }
-        else:  # if device already exists in DB, update the entry
-            dataset = database.get(dev)
+        log("Checking %s" % dev)
         try:
-            print("Checking %s" % dev)
-            dataset["data"] = check_printer(dev, rule_list)
-        # Create a new DB entry if it does not exist, yet
-
+            data = check_printer(dev, rule_list)
         except EasySNMPConnectionError as e:
-            print("Error for %s: %s" % (dev, str(e)))
-            dataset["data"]["info"] = {"max_status": 2, "name": dev, "alerts": "Printer offline", "rgb": COLOR.HEADER_CRITICAL}
-        finally:
-            dataset["data"]["info"]["checked"] = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
-            database.save(dataset)
+            store_printer(sink, dev, error=e)
+        else:
+            store_printer(sink, dev, data)
+
+
+def log(message):
+    """
+    Prints a diagnostic message
+    :param message: text to print
+    :return: None
+    """
+    print(message, file=sys.stderr if LOG_TO_STDERR else sys.stdout)
+
+
+def print_rate_limit_stats(limiter, reset=False):
+    """
+    Prints queue depth and wait time statistics of the rate limiter, used to tune the limits
+    :param limiter: RateLimiter object
+    :param reset: whether or not the next call only reports what happened after this one
+    :return: None
+    """
+    for site, s in sorted(limiter.get_stats(reset)["sites"].items()):
+        log("Rate limit %s: %d requests, wait avg %.3fs max %.3fs, max queue depth %d" % (
+            site, s["granted"], s["wait_avg"], s["wait_max"], s["max_depth"]))
+
+
+def make_document(dev, data=None, error=None):
+    """
+    Completes the result of a check, or creates an offline document if the check failed
+    :param dev: host name of the device
+    :param data: output of check_printer
+    :param error: exception raised while polling the device
+    :return: document to be written to the output sink
+    :rtype: dict
+    """
+    if error is not None:
+        log("Error for %s: %s" % (dev, str(error)))
+        data = {"info": {"max_status": 2, "name": dev, "alerts": "Printer offline", "rgb": COLOR.HEADER_CRITICAL}}
+    data["info"]["checked"] = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+    return data
+
+
+def store_printer(sink, dev, data=None, error=None):
+    """
+    Writes the result of a check to the output sink, or marks the device as offline if the check failed
+    :param sink: Sink object the result is written to
+    :param dev: host name of the device
+    :param data: output of check_printer
+    :param error: exception raised while polling the device
+    :return: None
+    """
+    sink.write(dev, make_document(dev, data, error))
+
+
+def create_client(snmp_config, limiter=None):
+    """
+    Creates an asyncsnmp client from the 'snmp' section of the config file
+    :param snmp_config: 'snmp' section of the config file
+    :param limiter: optional RateLimiter throttling the SNMP requests
+    :return: SNMPClient object, not opened yet
+    """
+    from asyncsnmp import SNMPClient
+    return SNMPClient(community=snmp_config.get("community", "public"),
+                      timeout=snmp_config.get("timeout", 1.0),
+                      retries=snmp_config.get("retries", 3),
+                      sockets=snmp_config.get("sockets", 4),
+                      port=snmp_config.get("port", 161),
+                      dns_ttl=snmp_config.get("dns_ttl", 300),
+                      dns_cache_size=snmp_config.get("dns_cache_size", 4096),
+                      limiter=limiter)
+
+
+def printer_stages(client, sink, get_rules, concurrency=256, site_concurrency=32):
+    """
+    Builds the stages of the poll pipeline: fetch -> parse -> rule evaluation -> sink
+    Offline devices pass through the pipeline with their error and are written as offline by the last stage.
+    If the client has a rate limiter, at most `site_concurrency` devices of the same rate limited site are fetched at
+    the same time, the fetch stage skips further devices of that site, so a throttled site cannot occupy every worker
+    :param client: open SNMPClient, or any object providing its get() and walk() coroutines
+    :param sink: sinks.AsyncSink the results are written to
+    :param get_rules: function returning the current list of rules. It is called when a device is fetched, so
+                      a check in flight keeps the rules it started with
+    :param concurrency: number of devices fetched at the same time
+    :param site_concurrency: number of devices of one rate limited site fetched at the same time
+    :return: list of pipeline.Stage objects
+    """
+    from asyncsnmp import fetch_printer
+    from pipeline import Stage
+    limiter = getattr(client, "limiter", None)
+
+    async def site(dev):
+        try:
+            address = await client.resolve(dev)
+        except Exception:
+            # not limited, the fetch reports the error
+            return None
+        return limiter.site(dev, address[0])
+
+    async def fetch(dev):
+        rules = get_rules()
+        try:
+            return dev, await fetch_printer(client, dev), rules, None
+        except Exception as e:
+            # any error of a single device (SNMP, DNS, ...) is stored as its result, it must not stop the pipeline
+            return dev, None, rules, e
+
+    def parse(item):
+        dev, props, rules, error = item
+        if error is not None:
+            return item
+        try:
+            return dev, parse_printer(props), rules, None
+        except Exception as e:
+            log("Error for %s: %s" % (dev, str(e)))
+            return None
+
+    def evaluate(item):
+        dev, parsed, rules, error = item
+        if error is not None:
+            return item
+        try:
+            return dev, evaluate_printer(dev, rules, *parsed), rules, None
+        except Exception as e:
+            log("Error for %s: %s" % (dev, str(e)))
+            return None
+
+    async def write(item):
+        dev, data, _, error = item
+        try:
+            await sink.write(dev, make_document(dev, data, error))
+        except Exception as e:
+            log("Error writing %s: %s" % (dev, str(e)))
+
+    return [Stage("fetch", fetch, concurrency, key=site if limiter else None, key_limit=site_concurrency),
+            Stage("parse", parse), Stage("evaluate", evaluate), Stage("write", write)]
+
+
+async def check_printers_async(sink, h, rule_list, snmp_config, limiter=None):
+    """
+    Same as check_printers, but polls the devices concurrently using the asyncsnmp backend
+    The devices flow through a pipeline with bounded queues, so memory use does not grow with the number of devices
+    :param sink: Sink object the results are written to
+    :param h: host names of the devices to be checked, any iterable
+    :param rule_list: list of rules to be matched against
+    :param snmp_config: 'snmp' section of the config file
+    :param limiter: optional RateLimiter throttling the SNMP requests
+    :return: None
+    """
+    from pipeline import run_pipeline
+    from sinks import AsyncSink
+    async with AsyncSink(sink) as async_sink, create_client(snmp_config, limiter) as client:
+        await run_pipeline(h, printer_stages(client, async_sink, lambda: rule_list,
+                                             snmp_config.get("concurrency", 256),
+                                             snmp_config.get("site_concurrency", 32)),
+                           snmp_config.get("queue_size", 64))
+
+
+class Poller(object):
+    """
+    Long-running poller, checks every host each `interval` seconds using the asyncsnmp backend
+    The checks of a cycle are spread over the interval and run through the same bounded pipeline as
+    check_printers_async. The config file is watched for changes: added hosts are checked right away and included in
+    the following cycles, removed hosts are skipped (checks in flight are finished), and only changed rules are
+    recompiled. Checks in flight keep the rules they started with.
+    Changes to the 'snmp', 'ratelimit', 'poller' and 'output' sections require a restart.
+    The statistics of the rate limiter are printed at the end of every cycle
+    """
+    def __init__(self, config_file, sink, config, limiter=None):
+        poller = config.get("poller") or {}
+        self.config_file = config_file
+        self.sink = sink
+        self.interval = poller.get("interval", 300)
+        self.reload_interval = poller.get("reload", 5)
+        self.snmp_config = config.get("snmp") or {}
+        self.limiter = limiter
+        self.hosts = set()
+        self.rules = []
+        self._rule_data = []
+        self._added = []
+        self._wakeup = None
+        self._mtime = None
+
+    def update_rules(self, rule_list):
+        """
+        Replaces the rules, reusing the Rule objects of rules that did not change
+        :param rule_list: 'rules' section of the config file
+        :return: number of compiled rules
+        :rtype: int
+        """
+        rules, compiled = self._compile_rules(rule_list)
+        self._rule_data = list(rule_list)
+        self.rules = rules
+        return compiled
+
+    def _compile_rules(self, rule_list):
+        """
+        Builds the new rule list without changing the poller's state, so an invalid rule leaves the old rules in place
+        :return: list of Rule objects, number of compiled rules
+        :rtype: tuple
+        """
+        old = list(zip(self._rule_data, self.rules))
+        rules = []
+        compiled = 0
+        for data in rule_list:
+            for idx, (old_data, rule) in enumerate(old):
+                if old_data == data:
+                    rules.append(rule)
+                    del old[idx]
+                    break
+            else:
+                rules.append(Rule(data))
+                compiled += 1
+        return rules, compiled
+
+    def update_hosts(self, host_list):
+        """
+        Schedules added hosts and unschedules removed ones
+        :param host_list: 'hosts' section of the config file
+        :return: added hosts, removed hosts
+        :rtype: tuple
+        """
+        hosts = set(host_list)
+        added = sorted(hosts - self.hosts)
+        removed = sorted(self.hosts - hosts)
+        self.hosts = hosts
+        self._added.extend(added)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return added, removed
+
+    def reload(self):
+        """
+        Applies the config file if it changed since the last call
+        An invalid config is reported and ignored, the poller keeps running with the previous one
+        :return: None
+        """
+        try:
+            mtime = os.stat(self.config_file).st_mtime_ns
+        except OSError as e:
+            log("Cannot read config %s: %s" % (self.config_file, str(e)))
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            config = read_config(self.config_file)
+            for key in ("hosts", "rules"):
+                if type(config.get(key)) is not list:
+                    raise ValueError("%s must be a list" % key)
+            hosts = set(config["hosts"])
+            rules, compiled = self._compile_rules(config["rules"])
+        except Exception as e:
+            log("Ignoring invalid config %s: %s" % (self.config_file, str(e)))
+            return
+        # the new config is valid, apply hosts and rules together
+        self._rule_data = list(config["rules"])
+        self.rules = rules
+        added, removed = self.update_hosts(hosts)
+        log("Loaded %s: %d rules (%d compiled), %d hosts added, %d removed" % (
+            self.config_file, len(self.rules), compiled, len(added), len(removed)))
+
+    async def run(self):
+        """
+        Polls the hosts until cancelled
+        :return: None
+        """
+        import asyncio
+        from pipeline import run_pipeline
+        from sinks import AsyncSink
+        self.reload()
+        async with AsyncSink(self.sink) as async_sink, create_client(self.snmp_config, self.limiter) as client:
+            watcher = asyncio.ensure_future(self._watch())
+            try:
+                await run_pipeline(self._schedule(),
+                                   printer_stages(client, async_sink, lambda: self.rules,
+                                                  self.snmp_config.get("concurrency", 256),
+                                                  self.snmp_config.get("site_concurrency", 32)),
+                                   self.snmp_config.get("queue_size", 64))
+            finally:
+                watcher.cancel()
+
+    async def _watch(self):
+        import asyncio
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                # never stop watching the config, the next change may fix the problem
+                log("Reloading %s failed: %s" % (self.config_file, str(e)))
+
+    async def _schedule(self):
+        """
+        Endless source of the pipeline, yields every host once per interval and added hosts right away
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            # hosts added before the start of a cycle are part of it anyway
+            self._added = []
+            hosts = sorted(self.hosts)
+            start = loop.time()
+            # None marks the end of the cycle
+            for idx, host in enumerate(hosts + [None]):
+                deadline = start + (self.interval if host is None else self.interval * idx / len(hosts))
+                while True:
+                    while self._added:
+                        yield self._added.pop(0)
+                    delay = deadline - loop.time()
+                    if delay <= 0:
+                        break
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                if host is not None and host in self.hosts:
+                    yield host
+            if self.limiter:
+                print_rate_limit_stats(self.limiter, reset=True)
 
 
 if __name__ == "__main__":
@@ -216,20 +552,46 @@ if __name__ == "__main__":
         sys.exit(3)
     config_file = sys.argv[1]
 
-    with open(config_file) as f:
-        config = yaml.load(f)
-        if "hosts" not in config:
-            print("No hosts defined")
-            sys.exit(1)
-        if "rules" not in config:
-            print("No rules defined")
-            sys.exit(2)
-        rules = Rule.parse_rules(config["rules"])
-        if len(sys.argv) == 3:
-            hosts = [sys.argv[2]]
-        else:
-            hosts = config["hosts"]
+    config, rules = load_config(config_file)
+    if "hosts" not in config:
+        print("No hosts defined")
+        sys.exit(1)
+    if "rules" not in config:
+        print("No rules defined")
+        sys.exit(2)
+    if len(sys.argv) == 3:
+        hosts = [sys.argv[2]]
+    else:
+        hosts = config["hosts"]
 
-        db = couchdb.Server(DB_URL)[DB_DATABASE]
-        # Run checks and update DB
-        check_printers(db, hosts, rules)
+    # The sinks and SNMP backends are only imported once the config is known to be valid
+    from sinks import create_sink
+    sink = create_sink(config.get("output") or {"type": "couchdb", "url": DB_URL, "database": DB_DATABASE})
+    LOG_TO_STDERR = sink.writes_stdout
+    # Run checks and write the results
+    snmp = config.get("snmp") or {}
+    try:
+        if (config.get("poller") or {}).get("interval") and len(sys.argv) == 2:
+            # run forever, reloading the config file on changes
+            import asyncio
+            from ratelimit import RateLimiter
+            limiter = RateLimiter(config["ratelimit"]) if config.get("ratelimit") else None
+            try:
+                asyncio.run(Poller(config_file, sink, config, limiter).run())
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if limiter:
+                    limiter.close()
+        elif snmp.get("backend") == "async":
+            import asyncio
+            from ratelimit import RateLimiter
+            limiter = RateLimiter(config["ratelimit"]) if config.get("ratelimit") else None
+            asyncio.run(check_printers_async(sink, hosts, rules, snmp, limiter))
+            if limiter:
+                limiter.close()
+                print_rate_limit_stats(limiter)
+        else:
+            check_printers(sink, hosts, rules)
+    finally:
+        sink.close()
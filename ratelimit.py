@@ -0,0 +1,299 @@
+"""
+Token bucket rate limiting for the asyncsnmp backend
+
+Requests are limited globally, per site (an explicit subnet or host list, or automatically per subnet) and per host.
+Waiting requests are queued per site. Sites are served round-robin, so a site that is throttled by its own limit does
+not hold back the requests to other sites, and the requests of a site are granted in the order they were made, so its
+hosts finish one after the other instead of all of them at the end.
+"""
+import asyncio
+import collections
+import ipaddress
+import time
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: refills with `rate` tokens per second up to `burst` tokens, every request takes one token
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(self.rate, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        """
+        Returns how long to wait until a token is available
+        :param now: current time.monotonic() value
+        :return: seconds to wait, 0 if a token is available
+        :rtype: float
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def full(self, now):
+        """
+        :param now: current time.monotonic() value
+        :return: whether the bucket has refilled completely, and so behaves like a new one
+        :rtype: bool
+        """
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class Site(object):
+    """
+    A group of hosts sharing one bucket, as defined in the 'sites' section of the rate limit config
+    """
+    def __init__(self, data):
+        if "name" not in data:
+            raise KeyError("name field missing in site")
+        if "rate" not in data:
+            raise KeyError("rate field missing in site %s" % data["name"])
+        self.name = data["name"]
+        self.rate = float(data["rate"])
+        self.burst = None if "burst" not in data else float(data["burst"])
+        self.hosts = set() if "hosts" not in data else set(data["hosts"])
+        subnets = [] if "subnet" not in data else data["subnet"]
+        if type(subnets) is str:
+            subnets = [subnets]
+        self.subnets = [ipaddress.ip_network(s, strict=False) for s in subnets]
+
+    def matches(self, host, address):
+        """
+        Checks whether or not a host belongs to the site
+        :param host: host name as given in the config
+        :param address: resolved IP address of the host
+        :return: True if the host is listed or its address is in one of the site's subnets
+        """
+        if host in self.hosts:
+            return True
+        if self.subnets:
+            ip = ipaddress.ip_address(address)
+            return any(ip in net for net in self.subnets)
+        return False
+
+
+class _Waiter(object):
+    __slots__ = ("future", "host", "site", "enqueued")
+
+    def __init__(self, future, host, site, enqueued):
+        self.future = future
+        self.host = host
+        self.site = site
+        self.enqueued = enqueued
+
+
+class RateLimiter(object):
+    """
+    Fair scheduler granting requests according to global, per-site and per-host token buckets
+    """
+    # seconds between two passes dropping the state of idle hosts
+    prune_interval = 60.0
+
+    def __init__(self, data):
+        """
+        :param data: 'ratelimit' section of the config file, e.g.
+                     {"global": {"rate": 500}, "host": {"rate": 10, "burst": 5},
+                      "subnet": {"prefix": 24, "rate": 50},
+                      "sites": [{"name": "branch", "subnet": "10.20.0.0/16", "rate": 20}]}
+        :type data: dict
+        """
+        self.global_bucket = None if "global" not in data else TokenBucket(data["global"]["rate"],
+                                                                           data["global"].get("burst"))
+        self.host_limit = None if "host" not in data else data["host"]
+        self.subnet_limit = None if "subnet" not in data else data["subnet"]
+        self.sites = [] if "sites" not in data else [Site(s) for s in data["sites"]]
+        self._site_buckets = {}
+        self._host_buckets = {}
+        self._site_keys = {}
+        self._pruned = time.monotonic()
+        # site key -> deque of waiters, oldest first; the order of the dict is the round-robin order of the sites
+        self._queues = collections.OrderedDict()
+        self._depth = 0
+        self._wakeup = None
+        self._task = None
+        # Statistics are kept per rate limited site, hosts without a site are summarized as "default"
+        self._stats = collections.defaultdict(lambda: {"granted": 0, "wait_total": 0.0, "wait_max": 0.0,
+                                                       "max_depth": 0, "depth": 0})
+
+    def _site_key(self, host, address):
+        """
+        Determines the site of a host and creates its bucket
+        :return: name of the site, or the host itself if it does not belong to any rate limited site
+        """
+        if host in self._site_keys:
+            return self._site_keys[host]
+        key = None
+        for site in self.sites:
+            if site.matches(host, address):
+                key = site.name
+                if key not in self._site_buckets:
+                    self._site_buckets[key] = TokenBucket(site.rate, site.burst)
+                break
+        if key is None and self.subnet_limit:
+            net = ipaddress.ip_network("%s/%d" % (address, self.subnet_limit.get("prefix", 24)), strict=False)
+            key = str(net)
+            if key not in self._site_buckets:
+                self._site_buckets[key] = TokenBucket(self.subnet_limit["rate"], self.subnet_limit.get("burst"))
+        if key is None:
+            key = host
+        self._site_keys[host] = key
+        return key
+
+    def site(self, host, address):
+        """
+        Determines the rate limited site of a host
+        :param host: host name as given in the config
+        :param address: resolved IP address of the host
+        :return: name of the site or subnet whose bucket the host shares, None if the host is only limited on its own
+        """
+        key = self._site_key(host, address)
+        return key if key in self._site_buckets else None
+
+    def _stats_key(self, site):
+        return site if site in self._site_buckets else "default"
+
+    def _buckets(self, waiter):
+        buckets = []
+        if self.global_bucket:
+            buckets.append(self.global_bucket)
+        if waiter.site in self._site_buckets:
+            buckets.append(self._site_buckets[waiter.site])
+        if self.host_limit:
+            if waiter.host not in self._host_buckets:
+                self._host_buckets[waiter.host] = TokenBucket(self.host_limit["rate"], self.host_limit.get("burst"))
+            buckets.append(self._host_buckets[waiter.host])
+        return buckets
+
+    async def acquire(self, host, address):
+        """
+        Waits until a request to the given host may be sent
+        :param host: host name as given in the config
+        :param address: resolved IP address of the host
+        :return: None
+        """
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        now = time.monotonic()
+        if now - self._pruned >= self.prune_interval:
+            self._prune(now)
+        site = self._site_key(host, address)
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), host, site, now)
+        self._queues.setdefault(site, collections.deque()).append(waiter)
+        self._depth += 1
+        stats = self._stats[self._stats_key(site)]
+        stats["depth"] += 1
+        stats["max_depth"] = max(stats["max_depth"], stats["depth"])
+        self._wakeup.set()
+        await waiter.future
+
+    def _prune(self, now):
+        """
+        Drops the cached site and the bucket of every host whose bucket has refilled, so the state kept does not grow
+        with the number of hosts ever polled. Waiting requests keep their site, a new bucket is created on demand
+        """
+        self._pruned = now
+        for host in list(self._site_keys):
+            bucket = self._host_buckets.get(host)
+            if bucket is None or bucket.full(now):
+                del self._site_keys[host]
+                self._host_buckets.pop(host, None)
+
+    def _grant(self, now):
+        """
+        Grants as many waiting requests as the buckets allow, at most one per site and pass
+        Within a site, the oldest request whose host bucket has a token is granted
+        :return: seconds until the next request could be granted, None if nothing is waiting
+        """
+        delay = None
+        progress = True
+        while progress and self._queues:
+            progress = False
+            for site in list(self._queues):
+                if self.global_bucket:
+                    wait = self.global_bucket.delay(now)
+                    if wait > 0:
+                        return wait
+                queue = self._queues[site]
+                granted = False
+                site_bucket = self._site_buckets.get(site)
+                wait = site_bucket.delay(now) if site_bucket else 0.0
+                if wait > 0:
+                    delay = wait if delay is None else min(delay, wait)
+                    continue
+                for idx, waiter in enumerate(queue):
+                    if not waiter.future.cancelled():
+                        buckets = self._buckets(waiter)
+                        wait = max([b.delay(now) for b in buckets] + [0.0])
+                        if wait > 0:
+                            delay = wait if delay is None else min(delay, wait)
+                            continue
+                        for b in buckets:
+                            b.consume()
+                        waiter.future.set_result(None)
+                        self._record(waiter, now)
+                    del queue[idx]
+                    self._depth -= 1
+                    self._stats[self._stats_key(site)]["depth"] -= 1
+                    granted = True
+                    break
+                if not queue:
+                    del self._queues[site]
+                elif granted:
+                    # Move the site to the end of the round-robin order
+                    self._queues.move_to_end(site)
+                progress = progress or granted
+        return delay
+
+    def _record(self, waiter, now):
+        stats = self._stats[self._stats_key(waiter.site)]
+        wait = now - waiter.enqueued
+        stats["granted"] += 1
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+
+    async def _run(self):
+        while True:
+            delay = self._grant(time.monotonic())
+            self._wakeup.clear()
+            if delay is None:
+                await self._wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self, reset=False):
+        """
+        Returns queue depth and wait time statistics, overall and per site
+        :param reset: whether or not to start over counting requests, wait times and maximum queue depths afterwards
+        :return: {"depth": current number of waiting requests, "sites": {site: {"granted", "wait_avg", "wait_max",
+                 "depth", "max_depth"}}}
+        :rtype: dict
+        """
+        sites = dict()
+        for site, s in self._stats.items():
+            sites[site] = {
+                "granted": s["granted"],
+                "wait_avg": s["wait_total"] / s["granted"] if s["granted"] else 0.0,
+                "wait_max": s["wait_max"],
+                "depth": s["depth"],
+                "max_depth": s["max_depth"]
+            }
+            if reset:
+                s.update(granted=0, wait_total=0.0, wait_max=0.0, max_depth=s["depth"])
+        return {"depth": self._depth, "sites": sites}
@@ -0,0 +1,284 @@
+"""
+Output sinks for the documents created by printerpoller
+
+Every sink receives one document per checked host as soon as it is ready, buffered sinks store it on the next flush.
+A document has the form {"info": {...}, "supplies": [...], "trays": [...]}; for offline devices it only contains "info".
+"""
+import collections
+import json
+import os
+import sys
+import time
+
+
+class Sink(object):
+    """
+    Abstract output sink
+    Buffered sinks are flushed by the first write at least `flush_interval` seconds after the last flush. AsyncSink also
+    flushes them from a timer, so a long-running poller does not hold back documents between two writes
+    """
+    # whether or not the documents are written to stdout
+    writes_stdout = False
+
+    def __init__(self, flush_interval=5.0):
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def write(self, host, data):
+        """
+        Writes the document of a host
+        :param host: host name of the device
+        :type host: str
+        :param data: document created by printerpoller
+        :type data: dict
+        :return: None
+        """
+        self._write(host, data)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _write(self, host, data):
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Writes buffered documents
+        :return: None
+        """
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+
+
+class CouchDBSink(Sink):
+    """
+    Stores one CouchDB document per host. For offline devices only the info of the existing document is replaced.
+    Documents are written in batches of up to `batch_size` hosts, with one _all_docs lookup and one _bulk_docs request
+    """
+    def __init__(self, url, database, batch_size=100, flush_interval=5.0):
+        super().__init__(flush_interval)
+        import couchdb
+        self.database = couchdb.Server(url)[database]
+        self.batch_size = batch_size
+        # host -> documents written since the last flush, in order
+        self._pending = collections.OrderedDict()
+
+    def _write(self, host, data):
+        self._pending.setdefault(host, []).append(data)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, collections.OrderedDict()
+            datasets = dict()
+            for row in self.database.view("_all_docs", keys=list(pending), include_docs=True):
+                if row.doc is not None:
+                    datasets[row.key] = row.doc
+            docs = []
+            for host, updates in pending.items():
+                # if device already exists in DB, update the entry
+                dataset = datasets.get(host) or {"_id": host, "data": {}}
+                for data in updates:
+                    dataset["data"].update(data)
+                docs.append(dataset)
+            for ok, doc_id, result in self.database.update(docs):
+                if not ok:
+                    print("Error saving %s: %s" % (doc_id, result), file=sys.stderr)
+        super().flush()
+
+
+class NDJSONSink(Sink):
+    """
+    Appends one JSON object per line ({"host": ..., "data": ...}) to a file or stdout
+    If `max_bytes` is given, the file is rotated like logging.handlers.RotatingFileHandler does: path -> path.1 -> ...
+    -> path.<backup_count>
+    """
+    def __init__(self, path="-", max_bytes=None, backup_count=5, buffer_size=2 ** 16, flush_interval=5.0):
+        super().__init__(flush_interval)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self._file = None
+        self._size = 0
+        self.writes_stdout = path == "-"
+        self._open()
+
+    def _open(self):
+        if self.path == "-":
+            self._file = sys.stdout
+            return
+        self._file = open(self.path, "a", buffering=self.buffer_size)
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+        for idx in range(self.backup_count - 1, 0, -1):
+            src = "%s.%d" % (self.path, idx)
+            if os.path.exists(src):
+                os.replace(src, "%s.%d" % (self.path, idx + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _write(self, host, data):
+        line = json.dumps({"host": host, "data": data}, separators=(",", ":")) + "\n"
+        if self.max_bytes and self._file is not sys.stdout and self._size > 0 and \
+                self._size + len(line) > self.max_bytes:
+            self._rotate()
+        self._file.write(line)
+        self._size += len(line)
+
+    def flush(self):
+        self._file.flush()
+        super().flush()
+
+    def close(self):
+        self.flush()
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class SQLiteSink(Sink):
+    """
+    Upserts one row per host into an SQLite database, `batch_size` documents per transaction
+    """
+    def __init__(self, path, batch_size=100, flush_interval=5.0):
+        super().__init__(flush_interval)
+        import sqlite3
+        self.batch_size = batch_size
+        self._rows = []
+        # the connection is used from the worker thread of AsyncSink and closed from the main thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS printers ("
+                                "host TEXT PRIMARY KEY, checked TEXT, max_status INTEGER, data TEXT)")
+
+    def _write(self, host, data):
+        info = data["info"]
+        self._rows.append((host, info.get("checked"), info.get("max_status"), json.dumps(data)))
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            with self.connection:
+                self.connection.executemany("INSERT INTO printers (host, checked, max_status, data) "
+                                            "VALUES (?, ?, ?, ?) ON CONFLICT(host) DO UPDATE SET "
+                                            "checked=excluded.checked, max_status=excluded.max_status, "
+                                            "data=excluded.data", self._rows)
+            self._rows = []
+        super().flush()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+class MultiSink(Sink):
+    """
+    Writes every document to several sinks
+    """
+    def __init__(self, sinks):
+        super().__init__(min(sink.flush_interval for sink in sinks))
+        self.sinks = sinks
+        self.writes_stdout = any(sink.writes_stdout for sink in sinks)
+
+    def _write(self, host, data):
+        for sink in self.sinks:
+            sink.write(host, data)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+        super().flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class AsyncSink(object):
+    """
+    Runs the blocking calls of a sink in one worker thread, so that database round-trips and disk writes do not stall
+    the SNMP requests on the event loop. All calls go through the same thread, so sinks do not need to be thread-safe.
+    While open, the sink is also flushed every `flush_interval` seconds, as documents may arrive too rarely for the
+    time-based flush in Sink.write
+    """
+    def __init__(self, sink):
+        self.sink = sink
+        self._executor = None
+        self._flusher = None
+
+    async def open(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(1)
+        self._flusher = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self):
+        """
+        Flushes the sink and waits for the pending calls, the wrapped sink is not closed
+        :return: None
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._executor is not None:
+            await self.flush()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _flush_periodically(self):
+        import asyncio
+        while True:
+            await asyncio.sleep(self.sink.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                # keep flushing, the database may be reachable again next time
+                print("Error flushing output: %s" % str(e), file=sys.stderr)
+
+    async def write(self, host, data):
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.sink.write, host, data)
+
+    async def flush(self):
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.sink.flush)
+
+
+SINK_TYPES = {
+    "couchdb": CouchDBSink,
+    "ndjson": NDJSONSink,
+    "sqlite": SQLiteSink
+}
+
+
+def create_sink(data):
+    """
+    Creates the sink(s) defined in the 'output' section of the config file
+    :param data: a sink definition like {"type": "ndjson", "path": "printers.ndjson"}, or a list of them.
+                 All keys except 'type' are passed to the sink's constructor
+    :return: Sink object
+    """
+    if type(data) is list:
+        sinks = [create_sink(d) for d in data]
+        return sinks[0] if len(sinks) == 1 else MultiSink(sinks)
+    if "type" not in data:
+        raise KeyError("type field missing in output")
+    if data["type"] not in SINK_TYPES:
+        raise ValueError("Unknown output type %s" % data["type"])
+    args = dict(data)
+    del args["type"]
+    return SINK_TYPES[data["type"]](**args)
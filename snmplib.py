@@ -1,4 +1,8 @@
-from easysnmp import Session
+import marshal
+import os
+
+# Bump when the layout of the config cache changes
+CONFIG_CACHE_VERSION = 1
 
 
 class SNMPWalkable(object):
@@ -59,6 +63,20 @@ class SNMPWalkable(object):
 
 
 class PrinterInfo(object):
+    # OIDs read by _gather_infos, used to prefetch them in one go (see asyncsnmp)
+    GET_OIDS = (
+        "1.3.6.1.2.1.43.5.1.1.17.1",
+        "1.3.6.1.2.1.1.5.0",
+        "1.3.6.1.2.1.1.6.0",
+        "1.3.6.1.2.1.1.1.0",
+        "1.3.6.1.2.1.1.4.0",
+        "1.3.6.1.2.1.43.5.1.1.4.1"
+    )
+    WALK_OIDS = (
+        "1.3.6.1.2.1.43.18.1.1.2",
+        "1.3.6.1.2.1.43.18.1.1.8",
+        "1.3.6.1.2.1.43.16.5"
+    )
 
     def __init__(self, session):
         self._gather_infos(session)
@@ -317,8 +335,17 @@ class PrinterProperties(object):
     """
     Wrapper object for all printer properties
     """
-    def __init__(self, host_name):
-        self.session = Session(hostname=host_name, community="public", version=2)
+    def __init__(self, host_name, session=None):
+        """
+        :param host_name: host name of the printer
+        :param session: object providing get() and walk() like an easysnmp Session, e.g. an asyncsnmp.SNMPSnapshot.
+                        If not given, a new easysnmp session is opened
+        """
+        if session is None:
+            # Imported here, so that tools that only read the config do not pay for loading easysnmp
+            from easysnmp import Session
+            session = Session(hostname=host_name, community="public", version=2)
+        self.session = session
 
     def get_supplies(self):
         return self._parse_data(Supply)
@@ -414,3 +441,71 @@ class Rule(object):
         for r in rule_list:
             out_list.append(Rule(r))
         return out_list
+
+
+def _config_cache_path(path):
+    """
+    :return: path of the cache of a config file, a hidden file next to the config or, if the config's directory is not
+             writable, a file in the per-user cache directory ($XDG_CACHE_HOME/snmptools) named after the config's path
+    :rtype: str
+    """
+    path = os.path.abspath(path)
+    directory, name = os.path.split(path)
+    if os.access(directory, os.W_OK):
+        return os.path.join(directory, ".%s.cache" % name)
+    import zlib
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "snmptools", "%s-%08x.cache" % (name, zlib.crc32(path.encode())))
+
+
+def read_config(path, use_cache=True):
+    """
+    Reads a YAML config file
+    Parsing the YAML file (and importing PyYAML) dominates the start-up time of a single host check, so the parsed
+    config is cached with marshal in a hidden file next to the config (or in the per-user cache directory if the config's
+    directory is read-only), keyed by the config's mtime and size.
+    The cache is silently skipped if it cannot be read or written
+    :param path: path of the YAML config file
+    :param use_cache: whether or not to read and write the cache
+    :return: config dictionary
+    :rtype: dict
+    """
+    st = os.stat(path)
+    key = (CONFIG_CACHE_VERSION, st.st_mtime_ns, st.st_size)
+    cache_path = _config_cache_path(path)
+    if use_cache:
+        try:
+            with open(cache_path, "rb") as f:
+                cached_key, cached_config = marshal.load(f)
+            if tuple(cached_key) == key:
+                return cached_config
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    import yaml
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    if use_cache:
+        tmp_path = "%s.%d" % (cache_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                marshal.dump((key, config), f)
+            os.replace(tmp_path, cache_path)
+        except (OSError, ValueError):
+            # not writable or the config contains values marshal cannot store
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return config
+
+
+def load_config(path, use_cache=True):
+    """
+    Reads a config file (see read_config) and compiles its rules
+    :param path: path of the YAML config file
+    :param use_cache: whether or not to read and write the config cache
+    :return: config dictionary, list of Rule objects
+    :rtype: tuple
+    """
+    config = read_config(path, use_cache)
+    rules = Rule.parse_rules(config["rules"]) if config.get("rules") else []
+    return config, rules
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Measures the start-up time of printercheck.py with and without the config cache
+Every run is a fresh interpreter started with -X importtime, which imports printercheck and loads the config the way
+printercheck.py does. No SNMP requests are sent.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from snmplib import _config_cache_path
+
+SNIPPET = "import printercheck; from snmplib import load_config; load_config(%r, use_cache=%r)"
+
+
+def parse_importtime(stderr):
+    """
+    Sums up the output of -X importtime
+    :param stderr: stderr of the interpreter
+    :return: total import time in ms, dict of top-level module name -> cumulative import time in ms
+    :rtype: tuple
+    """
+    modules = dict()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # nested imports are indented, only count the top-level ones
+        if not name.startswith("  "):
+            modules[name.strip()] = int(cumulative) / 1000.0
+    return sum(modules.values()), modules
+
+
+def run(config, mode, runs):
+    """
+    Starts `runs` interpreters in the given mode
+    :param config: path of the config file
+    :param mode: "nocache" (cache disabled), "cold" (cache deleted before every run) or "warm"
+    :return: average wall time in ms, average import time in ms, average import time of yaml in ms
+    :rtype: tuple
+    """
+    cache = _config_cache_path(config)
+    if mode == "warm":
+        # make sure the cache exists
+        subprocess.check_call([sys.executable, "-c", SNIPPET % (config, True)])
+    wall = imports = yaml_time = 0.0
+    for _ in range(runs):
+        if mode == "cold" and os.path.exists(cache):
+            os.remove(cache)
+        start = time.monotonic()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", SNIPPET % (config, mode != "nocache")],
+                              stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        wall += (time.monotonic() - start) * 1000
+        total, modules = parse_importtime(proc.stderr)
+        imports += total
+        yaml_time += modules.get("yaml", 0.0)
+    return wall / runs, imports / runs, yaml_time / runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the start-up time of printercheck.py.')
+    parser.add_argument("--config", "-c", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               "config.yml"))
+    parser.add_argument("--runs", "-n", type=int, default=20)
+    args = vars(parser.parse_args())
+
+    # relative to the current directory, not to the one of the benchmark
+    config_path = os.path.abspath(args["config"])
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    print("mode     wall time   imports    yaml")
+    for m in ["nocache", "cold", "warm"]:
+        w, i, y = run(config_path, m, args["runs"])
+        print("%-8s %6.1f ms %7.1f ms %5.1f ms" % (m, w, i, y))
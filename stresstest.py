@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Stress test of the poll pipeline with the real SNMPClient and RateLimiter
+The client's UDP sockets are replaced by a stub transport that answers every request with an encoded SNMP response,
+so request ids, address cache, rate limiter and BER decoding run as in production, only without a network.
+Reports throughput, peak RSS, the per-host state kept by client and rate limiter and the items processed and maximum
+input queue depth of every pipeline stage for each fleet size.
+"""
+from asyncsnmp import PDU_GET, PDU_RESPONSE, SNMP_VERSION_2C, TAG_END_OF_MIB_VIEW, TAG_NO_SUCH_OBJECT, \
+    TAG_OCTET_STRING, TAG_SEQUENCE, SNMPClient, _encode_integer, _encode_oid, _encode_tlv, _parse_oid, decode_request
+from printerpoller import printer_stages
+from pipeline import run_pipeline
+from ratelimit import RateLimiter
+from sinks import AsyncSink, NDJSONSink
+from snmplib import PrinterInfo, Rule, Supply, Tray
+import argparse
+import asyncio
+import bisect
+import os
+import resource
+import subprocess
+import sys
+import time
+import zlib
+
+RULES = [
+    {"name": "Check toner empty", "match": {"type": ["toner", "fuser"]}, "threshold": 1, "severity": 2},
+    {"name": "Check toner low", "match": {"type": ["toner", "fuser"]}, "stop": True, "threshold": 10, "severity": 1},
+    {"name": "Check trays", "match": {"type": "tray"}, "status": 8, "severity": 1}
+]
+
+# high enough not to limit the throughput, the limiter still keeps its buckets per host and subnet
+RATELIMIT = {
+    "global": {"rate": 100000, "burst": 1000},
+    "host": {"rate": 1000, "burst": 20},
+    "subnet": {"prefix": 24, "rate": 10000, "burst": 500}
+}
+
+
+def printer_mib(supplies=8, trays=4):
+    """
+    Creates the MIB of a simulated printer
+    :return: dict of OID tuple -> value (int or str)
+    """
+    mib = dict()
+    for idx, oid in enumerate(PrinterInfo.GET_OIDS):
+        mib[_parse_oid(oid)] = "Info %d" % idx
+    mib[_parse_oid(PrinterInfo.WALK_OIDS[0] + ".1.1")] = 4
+    for oid in PrinterInfo.WALK_OIDS[1:]:
+        mib[_parse_oid(oid + ".1.1")] = "Ready"
+    columns = [(Supply.STRUCTURE, supplies, {"class": 3, "type": 21, "name": "Toner Cartridge %d", "unit": 19,
+                                             "capacity": 100, "level": None}),
+               (Tray.STRUCTURE, trays, {"level": -3, "status": 0, "paper": "Plain", "name": "Tray %d"})]
+    for structure, rows, values in columns:
+        for oid, field in structure.items():
+            for idx in range(1, rows + 1):
+                value = values[field]
+                if value is None:
+                    value = (idx * 7) % 100
+                elif type(value) is str and "%d" in value:
+                    value = value % idx
+                mib[_parse_oid("%s.1.%d" % (oid, idx))] = value
+    return mib
+
+
+class StubTransport(object):
+    """
+    Takes the place of the UDP sockets of an SNMPClient: every request is answered like a printer with the given number
+    of supplies and trays would after `latency` seconds. A fraction of the hosts is offline and never answers
+    """
+    def __init__(self, client, latency=0.01, supplies=8, trays=4, offline=0.01):
+        self.client = client
+        self.latency = latency
+        self.offline = offline
+        self.requests = 0
+        mib = printer_mib(supplies, trays)
+        self._oids = sorted(mib)
+        self._varbinds = [self._encode_varbind(oid, mib[oid]) for oid in self._oids]
+        # encoded noSuchObject / endOfMibView varbinds by OID, requested over and over again
+        self._exceptions = dict()
+
+    def _exception(self, oid, tag):
+        if (oid, tag) not in self._exceptions:
+            self._exceptions[(oid, tag)] = self._encode_varbind(oid, None, tag)
+        return self._exceptions[(oid, tag)]
+
+    @staticmethod
+    def _encode_varbind(oid, value, tag=None):
+        if tag is not None:
+            encoded = _encode_tlv(tag, b"")
+        elif type(value) is int:
+            encoded = _encode_integer(value)
+        else:
+            encoded = _encode_tlv(TAG_OCTET_STRING, value.encode())
+        return _encode_tlv(TAG_SEQUENCE, _encode_oid(oid) + encoded)
+
+    def _respond(self, packet):
+        """
+        Answers a GET or GETBULK request
+        :return: encoded response
+        :rtype: bytes
+        """
+        community, pdu_type, request_id, _, repetitions, oids = decode_request(packet)
+        varbinds = []
+        if pdu_type == PDU_GET:
+            for oid in oids:
+                idx = bisect.bisect_left(self._oids, oid)
+                if idx < len(self._oids) and self._oids[idx] == oid:
+                    varbinds.append(self._varbinds[idx])
+                else:
+                    varbinds.append(self._exception(oid, TAG_NO_SUCH_OBJECT))
+        else:
+            # GETBULK: one row per repetition, each row holds the successors of all requested OIDs
+            current = list(oids)
+            for _ in range(repetitions):
+                for col, oid in enumerate(current):
+                    idx = bisect.bisect_right(self._oids, oid)
+                    if idx < len(self._oids):
+                        varbinds.append(self._varbinds[idx])
+                        current[col] = self._oids[idx]
+                    else:
+                        varbinds.append(self._exception(oid, TAG_END_OF_MIB_VIEW))
+        pdu = _encode_tlv(PDU_RESPONSE, _encode_integer(request_id) + _encode_integer(0) + _encode_integer(0) +
+                          _encode_tlv(TAG_SEQUENCE, b"".join(varbinds)))
+        return _encode_tlv(TAG_SEQUENCE, _encode_integer(SNMP_VERSION_2C) +
+                           _encode_tlv(TAG_OCTET_STRING, community.encode()) + pdu)
+
+    def sendto(self, packet, address):
+        self.requests += 1
+        if zlib.crc32(address[0].encode()) % 10000 < self.offline * 10000:
+            return
+        asyncio.get_running_loop().call_later(self.latency, self.client._dispatch, self._respond(packet), address)
+
+    def close(self):
+        pass
+
+
+class StubClient(SNMPClient):
+    """
+    SNMPClient whose requests are answered by a StubTransport instead of being sent over the network
+    """
+    def __init__(self, latency=0.01, **kwargs):
+        super().__init__(**kwargs)
+        self.transport = StubTransport(self, latency)
+
+    async def open(self):
+        self._transports = [self.transport]
+
+    async def _lookup(self, host):
+        # printer-<idx> resolves to a distinct address in 10.0.0.0/8 without querying a name server
+        idx = int(host.rsplit("-", 1)[1])
+        return "10.%d.%d.%d" % ((idx >> 16) & 0xFF, (idx >> 8) & 0xFF, idx & 0xFF), self.port
+
+
+def run(num_hosts, concurrency, queue_size, latency):
+    """
+    Polls `num_hosts` simulated printers and writes the results to /dev/null as NDJSON
+    :return: elapsed seconds, number of SNMP requests, peak RSS in MiB, cached addresses of the client, host buckets of
+             the rate limiter, pipeline stages
+    :rtype: tuple
+    """
+    limiter = RateLimiter(RATELIMIT)
+    client = StubClient(latency=latency, timeout=0.1, retries=1, limiter=limiter)
+    sink = NDJSONSink(os.devnull)
+    rules = Rule.parse_rules(RULES)
+    # host names rather than addresses, so that the address cache of the client is used
+    hosts = ("printer-%d" % idx for idx in range(num_hosts))
+    # the prints of the pipeline (offline hosts) would dominate the run time
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    stages = []
+    start = time.monotonic()
+
+    async def main():
+        async with AsyncSink(sink) as async_sink, client:
+            stages.extend(printer_stages(client, async_sink, lambda: rules, concurrency))
+            await run_pipeline(hosts, stages, queue_size)
+
+    try:
+        asyncio.run(main())
+    finally:
+        limiter.close()
+        sys.stdout.close()
+        sys.stdout = stdout
+        sink.close()
+    elapsed = time.monotonic() - start
+    return elapsed, client.transport.requests, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, \
+        len(client._addresses), len(limiter._host_buckets), stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Stress test the poll pipeline with a simulated SNMP transport.')
+    parser.add_argument("--hosts", "-n", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--concurrency", "-c", type=int, default=256)
+    parser.add_argument("--queue-size", "-q", type=int, default=64)
+    parser.add_argument("--latency", "-l", type=float, default=0.01)
+    args = vars(parser.parse_args())
+
+    if len(args["hosts"]) > 1:
+        # every fleet size runs in its own process, so that the peak RSS values are independent
+        for n in args["hosts"]:
+            subprocess.check_call([sys.executable, __file__, "-n", str(n), "-c", str(args["concurrency"]),
+                                   "-q", str(args["queue_size"]), "-l", str(args["latency"])])
+        sys.exit(0)
+
+    n = args["hosts"][0]
+    elapsed, requests, rss, addresses, buckets, stages = run(n, args["concurrency"], args["queue_size"],
+                                                             args["latency"])
+    print("%7d printers: %6.1fs, %5.0f printers/s, %6.0f requests/s, peak RSS %6.1f MiB, %6d addresses, "
+          "%6d host buckets" % (n, elapsed, n / elapsed, requests / elapsed, rss, addresses, buckets))
+    # the queues in front of the slowest stage fill up, the ones behind it do not
+    print("                 " + ", ".join("%s %d (queue max %d)" % (stage.name, stage.processed, stage.max_depth)
+                                          for stage in stages))
@@ -0,0 +1,215 @@
+"""
+Tests of the asyncsnmp backend: BER codec, walks against a local agent and easysnmp compatibility
+"""
+import asyncio
+import unittest
+
+from asyncsnmp import PDU_GET, PDU_GETBULK, ERROR_TOO_BIG, TAG_COUNTER32, TAG_END_OF_MIB_VIEW, TAG_INTEGER, \
+    TAG_IPADDRESS, TAG_NO_SUCH_OBJECT, TAG_OBJECT_ID, TAG_OCTET_STRING, SNMPClient, SNMPError, SNMPSnapshot, \
+    decode_request, decode_response, encode_request, encode_response, fetch_printer
+
+
+class Agent(asyncio.DatagramProtocol):
+    """
+    Minimal SNMPv2c agent answering GET and GETBULK requests from a dict of OID tuple -> (tag, value)
+    Answers tooBig if more than `max_rows` repetitions are requested
+    """
+    def __init__(self, mib, max_rows=None):
+        self.mib = mib
+        self.oids = sorted(mib)
+        self.max_rows = max_rows
+        self.repetitions = []
+        self.columns = []
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        community, pdu_type, request_id, _, repetitions, oids = decode_request(data)
+        varbinds = []
+        status = 0
+        if pdu_type == PDU_GET:
+            for oid in oids:
+                tag, value = self.mib.get(oid, (TAG_NO_SUCH_OBJECT, None))
+                varbinds.append((oid, tag, value))
+        else:
+            self.repetitions.append(repetitions)
+            self.columns.append(len(oids))
+            if self.max_rows is not None and repetitions > self.max_rows:
+                status = ERROR_TOO_BIG
+            else:
+                # one row per repetition, each row holds the successors of all requested OIDs
+                current = list(oids)
+                for _ in range(repetitions):
+                    for idx, oid in enumerate(current):
+                        following = [o for o in self.oids if o > oid]
+                        if following:
+                            current[idx] = following[0]
+                            varbinds.append((following[0],) + self.mib[following[0]])
+                        else:
+                            varbinds.append((oid, TAG_END_OF_MIB_VIEW, None))
+        self.transport.sendto(encode_response(community, request_id, varbinds, status), addr)
+
+
+def table(column, rows):
+    return {column + (1, idx): (TAG_INTEGER, idx * 10) for idx in range(1, rows + 1)}
+
+
+class CodecTest(unittest.TestCase):
+    def test_request_round_trip(self):
+        oids = [(1, 3, 6, 1, 2, 1, 1, 5, 0), (1, 3, 6, 1, 4, 1, 128, 16383, 16384, 2 ** 32 - 1), (2, 999, 1)]
+        data = encode_request("public", PDU_GETBULK, 2 ** 31 - 2, oids, 0, 25)
+        self.assertEqual(decode_request(data), ("public", PDU_GETBULK, 2 ** 31 - 2, 0, 25, oids))
+
+    def test_negative_integers(self):
+        values = [0, -1, 127, 128, -128, -129, 2 ** 31 - 1, -2 ** 31]
+        varbinds = [((1, 3, 6, 1, idx), TAG_INTEGER, value) for idx, value in enumerate(values)]
+        request_id, status, index, decoded = decode_response(encode_response("public", 7, varbinds))
+        self.assertEqual((request_id, status, index), (7, 0, 0))
+        self.assertEqual([var.value for _, var in decoded], [str(v) for v in values])
+        self.assertEqual({var.snmp_type for _, var in decoded}, {"INTEGER"})
+
+    def test_multi_byte_lengths(self):
+        # 300 bytes need a two byte length, the whole message of 70000 bytes a three byte length
+        varbinds = [((1, 3, 6, 1, 2, idx), TAG_OCTET_STRING, chr(65 + idx % 26) * 300) for idx in range(230)]
+        data = encode_response("public", 1, varbinds)
+        self.assertGreater(len(data), 65536)
+        _, _, _, decoded = decode_response(data)
+        self.assertEqual([(oid, var.value) for oid, var in decoded], [(oid, value) for oid, _, value in varbinds])
+
+    def test_large_sub_ids(self):
+        oid = (1, 3, 6, 1, 4, 1, 128, 255, 16384, 2 ** 32 - 1)
+        _, _, _, decoded = decode_response(encode_response("public", 1, [(oid, TAG_OBJECT_ID, oid)]))
+        self.assertEqual(decoded[0][0], oid)
+        self.assertEqual(decoded[0][1].oid, "1.3.6.1.4.1.128.255.16384.4294967295")
+        self.assertEqual(decoded[0][1].value, ".1.3.6.1.4.1.128.255.16384.4294967295")
+        self.assertEqual(decoded[0][1].oid_index, "4294967295")
+
+    def test_value_types(self):
+        varbinds = [((1, 3, 1), TAG_COUNTER32, 2 ** 32 - 1), ((1, 3, 2), TAG_IPADDRESS, "10.1.2.3"),
+                    ((1, 3, 3), TAG_NO_SUCH_OBJECT, None)]
+        _, _, _, decoded = decode_response(encode_response("public", 1, varbinds))
+        self.assertEqual([(var.value, var.snmp_type) for _, var in decoded],
+                         [("4294967295", "COUNTER"), ("10.1.2.3", "IPADDR"), ("NOSUCHOBJECT", "NOSUCHOBJECT")])
+
+    def test_truncated_message(self):
+        data = encode_response("public", 1, [((1, 3, 6, 1), TAG_OCTET_STRING, "x" * 50)])
+        with self.assertRaises(SNMPError):
+            decode_response(data[:-10])
+
+
+class ClientTest(unittest.IsolatedAsyncioTestCase):
+    COLUMN = (1, 3, 6, 1, 2, 1, 43, 11, 1, 1, 6)
+
+    async def start_agent(self, mib, max_rows=None):
+        loop = asyncio.get_running_loop()
+        transport, agent = await loop.create_datagram_endpoint(lambda: Agent(mib, max_rows),
+                                                               local_addr=("127.0.0.1", 0))
+        self.addCleanup(transport.close)
+        client = SNMPClient(timeout=0.5, retries=0, port=transport.get_extra_info("sockname")[1])
+        await client.open()
+        self.addCleanup(client.close)
+        return client, agent
+
+    async def test_walk_stops_at_end_of_subtree(self):
+        mib = table(self.COLUMN, 8)
+        mib.update(table(self.COLUMN[:-1] + (7,), 8))
+        client, agent = await self.start_agent(mib)
+        result = await client.walk("127.0.0.1", "1.3.6.1.2.1.43.11.1.1.6")
+        self.assertEqual([var.value for var in result], [str(idx * 10) for idx in range(1, 9)])
+        self.assertEqual(result[0].oid, "1.3.6.1.2.1.43.11.1.1.6.1.1")
+        self.assertEqual(agent.repetitions, [client.max_repetitions])
+
+    async def test_walk_stops_at_end_of_mib_view(self):
+        client, agent = await self.start_agent(table(self.COLUMN, 30))
+        result = await client.walk("127.0.0.1", "1.3.6.1.2.1.43.11.1.1.6")
+        self.assertEqual(len(result), 30)
+        self.assertEqual(len(agent.repetitions), 2)
+
+    async def test_walk_of_missing_subtree(self):
+        client, _ = await self.start_agent(table(self.COLUMN, 3))
+        # like easysnmp, walking a subtree that does not exist returns no variables
+        self.assertEqual(await client.walk("127.0.0.1", "1.3.6.1.2.1.43.8.2.1.10"), [])
+
+    async def test_walk_table(self):
+        supplies = (1, 3, 6, 1, 2, 1, 43, 11, 1, 1)
+        mib = table(supplies + (6,), 8)
+        mib.update(table(supplies + (9,), 8))
+        mib.update(table(supplies + (10,), 30))
+        client, agent = await self.start_agent(mib)
+        columns = ["1.3.6.1.2.1.43.11.1.1.6", "1.3.6.1.2.1.43.11.1.1.9", "1.3.6.1.2.1.43.11.1.1.10"]
+        result = await client.walk_table("127.0.0.1", columns)
+        self.assertEqual([len(result[column]) for column in columns], [8, 8, 30])
+        self.assertEqual([var.oid for var in result[columns[1]]][:2], ["1.3.6.1.2.1.43.11.1.1.9.1.1",
+                                                                        "1.3.6.1.2.1.43.11.1.1.9.1.2"])
+        # all three columns in the first request, only the long one afterwards
+        self.assertEqual(agent.columns, [3, 1])
+        # a column without rows is empty, the walk of its neighbours is not affected
+        result = await client.walk_table("127.0.0.1", ["1.3.6.1.2.1.43.11.1.1.7", columns[0]])
+        self.assertEqual([len(r) for r in result.values()], [0, 8])
+
+    async def test_too_big_halves_repetitions(self):
+        client, agent = await self.start_agent(table(self.COLUMN, 8), max_rows=3)
+        result = await client.walk("127.0.0.1", "1.3.6.1.2.1.43.11.1.1.6")
+        self.assertEqual(len(result), 8)
+        self.assertEqual(agent.repetitions[:4], [25, 12, 6, 3])
+        self.assertEqual(set(agent.repetitions[4:]), {3})
+
+    async def test_too_big_for_one_row_raises(self):
+        client, agent = await self.start_agent(table(self.COLUMN, 8), max_rows=0)
+        with self.assertRaises(SNMPError):
+            await client.walk("127.0.0.1", "1.3.6.1.2.1.43.11.1.1.6")
+        self.assertEqual(agent.repetitions, [25, 12, 6, 3, 1])
+
+    async def test_get_of_missing_oid(self):
+        client, _ = await self.start_agent({(1, 3, 6, 1, 2, 1, 1, 5, 0): (TAG_OCTET_STRING, "printer")})
+        name, serial = await client.get("127.0.0.1", [("1.3.6.1.2.1.1.5", 0), "1.3.6.1.2.1.43.5.1.1.17.1"])
+        self.assertEqual((name.value, name.snmp_type), ("printer", "OCTETSTR"))
+        # easysnmp returns value and type NOSUCHOBJECT for OIDs the agent does not know
+        self.assertEqual((serial.value, serial.snmp_type), ("NOSUCHOBJECT", "NOSUCHOBJECT"))
+
+    async def test_snapshot_matches_client(self):
+        mib = {(1, 3, 6, 1, 2, 1, 1, 5, 0): (TAG_OCTET_STRING, "printer")}
+        mib.update(table(self.COLUMN, 2))
+        client, _ = await self.start_agent(mib)
+        props = await fetch_printer(client, "127.0.0.1")
+        session = props.session
+        self.assertEqual(session.get(("1.3.6.1.2.1.1.5", 0)).value, "printer")
+        # the serial is not in the MIB: the snapshot answers like a GET to the agent, and like easysnmp
+        direct = (await client.get("127.0.0.1", ["1.3.6.1.2.1.43.5.1.1.17.1"]))[0]
+        cached = session.get("1.3.6.1.2.1.43.5.1.1.17.1")
+        self.assertEqual((cached.value, cached.snmp_type), (direct.value, direct.snmp_type))
+        self.assertEqual([var.value for var in session.walk("1.3.6.1.2.1.43.11.1.1.6")], ["10", "20"])
+        self.assertEqual(session.walk("1.3.6.1.2.1.43.8.2.1.10"), [])
+
+    async def test_address_cache(self):
+        lookups = []
+
+        async def lookup(host):
+            lookups.append(host)
+            await asyncio.sleep(0)
+            return "10.0.0.%d" % len(lookups), 161
+
+        client = SNMPClient(dns_cache_size=2)
+        client._lookup = lookup
+        self.assertEqual(await client.resolve("192.168.1.10"), ("192.168.1.10", 161))
+        # concurrent requests share one lookup
+        await asyncio.gather(client.resolve("a"), client.resolve("a"), client.resolve("b"))
+        await client.resolve("a")
+        await client.resolve("c")
+        # IP addresses are not cached, "b" was the least recently used host name
+        self.assertEqual(list(client._addresses), ["a", "c"])
+        self.assertEqual(lookups, ["a", "b", "c"])
+        self.assertEqual(client._lookups, {})
+
+class SnapshotTest(unittest.TestCase):
+    def test_missing_values(self):
+        session = SNMPSnapshot({}, {})
+        var = session.get(("1.3.6.1.2.1.1.5", 0))
+        self.assertEqual((var.value, var.snmp_type, var.oid_index), ("NOSUCHOBJECT", "NOSUCHOBJECT", "0"))
+        self.assertEqual(session.walk(".1.3.6.1.2.1.43.16.5"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()